@@ -6,72 +6,131 @@ Transforms critical code review comments into constructive, educational feedback
 
 import json
 import argparse
+import asyncio
+import hashlib
+import importlib.util
+import keyword
 import os
+import re
+import sqlite3
 import sys
-from typing import List, Dict, Any
-from groq import Groq
+import threading
+from functools import lru_cache
+from string import Template
+from typing import List, Dict, Any, ClassVar, Optional, TextIO, TypedDict, Union
+
+import httpx
+from groq import APIConnectionError, AsyncGroq, Groq, InternalServerError, RateLimitError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the standard library
+    orjson = None
+
+try:
+    from pygments.lexers import guess_lexer
+    from pygments.util import ClassNotFound
+except ImportError:  # Pygments is optional; fall back to the default language
+    guess_lexer = None
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional; fall back to a character-based estimate
+    tiktoken = None
+
 # Load environment variables
 load_dotenv()
 
-class EmpathethicCodeReviewer:
-    """
-    AI-powered code review comment transformer that converts harsh feedback
-    into empathetic, educational guidance.
-    """
-    
-    def __init__(self, api_key: str = None):
-        """Initialize the reviewer with Groq API key."""
-        self.client = Groq(
-            api_key=api_key or os.getenv("GROQ_API_KEY"),
-        )
-    
-    def _analyze_comment_severity(self, comment: str) -> str:
-        """Analyze the severity/tone of a review comment."""
-        harsh_indicators = ['bad', 'wrong', 'terrible', 'awful', 'stupid', 'inefficient', 'don\'t']
-        neutral_indicators = ['could', 'might', 'consider', 'suggest']
-        
-        comment_lower = comment.lower()
-        
-        if any(indicator in comment_lower for indicator in harsh_indicators):
-            return "harsh"
-        elif any(indicator in comment_lower for indicator in neutral_indicators):
-            return "neutral"
-        else:
-            return "constructive"
-    
-    def _get_language_from_code(self, code_snippet: str) -> str:
-        """Detect programming language from code snippet."""
-        if 'def ' in code_snippet and ':' in code_snippet:
-            return "Python"
-        elif 'function' in code_snippet and '{' in code_snippet:
-            return "JavaScript"
-        elif 'public class' in code_snippet or 'private ' in code_snippet:
-            return "Java"
-        else:
-            return "Python"  # Default assumption
-    
-    def _create_empathetic_prompt(self, code_snippet: str, comments: List[str]) -> str:
-        """Create a sophisticated prompt for empathetic code review transformation."""
-        
-        language = self._get_language_from_code(code_snippet)
-        severity_analysis = [self._analyze_comment_severity(comment) for comment in comments]
-        
-        prompt = f"""You are an exceptional senior software engineer and mentor known for your ability to provide constructive, empathetic feedback that helps developers grow. Your mission is to transform direct, potentially harsh code review comments into supportive, educational guidance.
+# Fast, inexpensive default model; pass a larger model for deeper reasoning
+DEFAULT_MODEL = "llama-3.1-8b-instant"
 
-**Context:**
-- Programming Language: {language}
-- Number of comments to transform: {len(comments)}
-- Comment severity levels detected: {', '.join(set(severity_analysis))}
+# Connection pool shared by every reviewer instance
+MAX_CONNECTIONS = 32
 
-**Code Under Review:**
-```{language.lower()}
-{code_snippet}
-```
+# Exact-match response cache shared across CLI runs and test scenarios
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "empathetic_reviewer.db")
 
-**Original Review Comments:**
-{chr(10).join(f"{i+1}. {comment}" for i, comment in enumerate(comments))}
+# Semantic (near-duplicate) cache settings; requires sentence-transformers and hnswlib
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384
+SEMANTIC_MAX_DISTANCE = 0.05  # cosine similarity >= 0.95
+
+# Tone indicators used to classify review comments
+HARSH_RE = re.compile(r"\b(bad|wrong|terrible|awful|stupid|inefficient|don't)\b", re.I)
+NEUTRAL_RE = re.compile(r"\b(could|might|consider|suggest)\b", re.I)
+SEVERITY_LEVELS = ("harsh", "neutral", "constructive")
+
+# Language signatures, matched in a single scan; the earliest match wins
+LANG_RE = re.compile(
+    r"(?P<python>^\s*(?:async\s+)?def\s+\w+\s*\(|^\s*class\s+\w+\s*(?:\([^)]*\))?\s*:)"
+    r"|(?P<javascript>\bfunction\s*\w*\s*\(|=>|\b(?:const|let)\s+\w+\s*=)"
+    r"|(?P<java>\b(?:public|private|protected)\s+"
+    r"(?:(?:static|final|abstract|synchronized)\s+)*"
+    r"(?:class\b|[\w<>\[\],]+\s+\w+\s*[(=;]))",
+    re.M
+)
+LANG_NAMES = {"python": "Python", "javascript": "JavaScript", "java": "Java"}
+DEFAULT_LANGUAGE = "Python"
+
+# Pygments guesses are only trusted for these languages
+LEXER_LANGUAGES = {
+    "Python", "JavaScript", "TypeScript", "Java", "Kotlin", "C", "C++", "C#",
+    "Go", "Rust", "Ruby", "PHP", "Swift", "Bash", "SQL"
+}
+MIN_LEXER_CONFIDENCE = 0.1  # ignore low-confidence Pygments guesses
+
+# Output limits: decode time grows linearly with generated tokens
+MAX_TOKENS_PER_COMMENT = 600
+END_MARKER = "## End"
+STOP_SEQUENCES = ["\n" + END_MARKER]
+
+# Attempts per Groq request before giving up on transient errors
+MAX_ATTEMPTS = 5
+
+# Long snippets are trimmed to the regions referenced by the comments
+MAX_CODE_TOKENS = 1500
+TRIM_CONTEXT_LINES = 10
+HASH_COMMENT_LANGUAGES = {"Python", "Ruby", "Bash", "Perl", "R"}
+IDENTIFIER_RE = re.compile(r"[A-Za-z_]\w*")
+QUOTED_RE = re.compile(r"'([^']+)'|\"([^\"]+)\"|`([^`]+)`")
+
+# Short comments phrased as suggestions or praise are rendered locally without calling the model
+FAST_PATH_MAX_LENGTH = 80
+FAST_PATH_RE = re.compile(
+    r"\b(consider|could benefit|suggest|might want to|would be nice|well done)\b", re.I
+)
+# Negations and contrasts can turn a suggestion or praise into criticism
+FAST_PATH_EXCLUDE_RE = re.compile(
+    r"\b(not|no|cannot|but|however|garbage|ugly|horrible|useless|mess|messy|sloppy|lazy"
+    r"|ancient|pointless|unreadable|broken|rewrite|rewriting)\b|n['’]t\b",
+    re.I
+)
+ERROR_PREFIX = "Error generating empathetic review: "
+SECTION_RE = re.compile(r"^(?=### Analysis of Comment:)", re.M)
+OVERALL_HEADING = "## Overall Assessment"
+
+# Review guidance shared by the Markdown and JSON system prompts
+SYSTEM_INTRO = """You are an exceptional senior software engineer and mentor known for your ability to provide constructive, empathetic feedback that helps developers grow. Your mission is to transform direct, potentially harsh code review comments into supportive, educational guidance."""
+
+TONE_INSTRUCTIONS = """**Instructions for tone adaptation:**
+- For harsh comments: Be extra gentle and encouraging, acknowledge what's working first
+- For neutral comments: Maintain supportive tone while being direct about improvements  
+- For constructive comments: Enhance the existing positive tone with more detail"""
+
+QUALITY_STANDARDS = """**Quality Standards:**
+- Be specific and actionable, not generic
+- Ensure all code examples are syntactically correct and runnable
+- Provide genuine technical insights, not just politeness
+- Make explanations clear for developers at different skill levels
+- Include relevant links to authoritative sources when possible"""
+
+# Static review instructions, sent verbatim as the system message so the
+# provider can reuse its prompt-prefix cache across requests
+SYSTEM_PROMPT = SYSTEM_INTRO + """
+
+Each request gives you the programming language, the code under review and the original review comments. Use that language for all code blocks.
 
 **Your Task:**
 Transform each comment into a well-structured analysis following this exact format for each comment:
@@ -84,7 +143,7 @@ Transform each comment into a well-structured analysis following this exact form
 **The 'Why':** [Explain the underlying software engineering principle, performance consideration, or best practice. Make it educational and help the developer understand the deeper reasoning.]
 
 **Suggested Improvement:**
-```{language.lower()}
+```<language>
 [Provide a concrete, working code example that demonstrates the recommended fix. Ensure the code is syntactically correct and represents a meaningful improvement.]
 ```
 
@@ -92,10 +151,7 @@ Transform each comment into a well-structured analysis following this exact form
 
 ---
 
-**Instructions for tone adaptation:**
-- For harsh comments: Be extra gentle and encouraging, acknowledge what's working first
-- For neutral comments: Maintain supportive tone while being direct about improvements  
-- For constructive comments: Enhance the existing positive tone with more detail
+""" + TONE_INSTRUCTIONS + """
 
 **After analyzing all comments, add:**
 
@@ -107,54 +163,871 @@ Transform each comment into a well-structured analysis following this exact form
 3. Encourages continued learning and improvement
 4. Maintains an optimistic, supportive tone]
 
-**Quality Standards:**
-- Be specific and actionable, not generic
-- Ensure all code examples are syntactically correct and runnable
-- Provide genuine technical insights, not just politeness
-- Make explanations clear for developers at different skill levels
-- Include relevant links to authoritative sources when possible"""
+""" + QUALITY_STANDARDS + """
+
+Finish your output with '""" + END_MARKER + """' on its own line."""
+
+# System prompt for structured reviews, answered in JSON mode
+STRUCTURED_SYSTEM_PROMPT = SYSTEM_INTRO + """
+
+Each request gives you the programming language, the code under review and the original review comments.
+
+**Your Task:**
+Transform each comment and respond with a single JSON object in exactly this shape:
+
+{
+  "comments": [
+    {
+      "original": "[Original Comment]",
+      "positive": "[Rewrite the feedback to be encouraging and supportive while maintaining technical accuracy. Start with something positive about the code, then gently introduce the improvement opportunity.]",
+      "why": "[Explain the underlying software engineering principle, performance consideration, or best practice. Make it educational and help the developer understand the deeper reasoning.]",
+      "fix": "[A concrete, working code example in the request's language that demonstrates the recommended fix, without Markdown code fences.]",
+      "link": "[A relevant link to official documentation, style guides, or authoritative resources that support this recommendation.]"
+    }
+  ],
+  "overall": "[A holistic, encouraging summary that acknowledges the developer's effort and what they did well, frames the suggestions as growth opportunities, encourages continued learning and maintains an optimistic, supportive tone.]"
+}
+
+Include one entry in "comments" per original comment, in the original order.
+
+""" + TONE_INSTRUCTIONS + """
+
+""" + QUALITY_STANDARDS
+
+# Per-request prompt; only these slots change between requests
+PROMPT_TEMPLATE = Template("""**Context:**
+- Programming Language: $language
+- Number of comments to transform: $count
+- Comment severity levels detected: $severities
+
+**Code Under Review:**
+```$code_fence
+$code
+```
+
+**Original Review Comments:**
+$comments""")
+
+# Canned text for comments that are already constructive
+LOCAL_POSITIVE_PREFIX = "This is a thoughtful observation, and the code is already in good shape."
+LOCAL_WHY = "Small, deliberate refinements like this make code easier to read, test and maintain, and they help everyone who works on it later build on it with confidence."
+LOCAL_OVERALL_ASSESSMENT = "These comments are already constructive and point to small, focused improvements. The code is in good shape, and each suggestion is an easy opportunity to make it even clearer. Keep up the great work!"
+
+class CommentReview(TypedDict):
+    """Empathetic review of a single comment."""
+    original: str
+    positive: str
+    why: str
+    fix: str
+    link: str
+
+class StructuredReview(TypedDict):
+    """Empathetic review of all comments, as returned by review_code_structured."""
+    comments: List[CommentReview]
+    overall: str
+
+def render_comment_markdown(review: CommentReview, language: str = "") -> str:
+    """Render one comment review as a Markdown section; empty fix and link are omitted."""
+    section = f"""### Analysis of Comment: "{review['original']}"
+
+**Positive Rephrasing:** {review['positive']}
+
+**The 'Why':** {review['why']}
+
+"""
+    if review['fix']:
+        section += f"""**Suggested Improvement:**
+```{language.lower()}
+{review['fix']}
+```
+
+"""
+    if review['link']:
+        section += f"**Learn More:** {review['link']}\n\n"
+    return section + "---\n\n"
+
+def render_markdown(review: StructuredReview, language: str = "") -> str:
+    """Render a structured review in the same Markdown layout as review_code."""
+    sections = "".join(render_comment_markdown(comment, language) for comment in review['comments'])
+    return f"---\n{sections}{OVERALL_HEADING}\n\n{review['overall']}"
+
+def _json_loads(data):
+    """Parse JSON from str or bytes, using orjson when available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
-        return prompt
+def _json_dumps(obj) -> str:
+    """Serialize an object as indented JSON, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(obj, indent=2, ensure_ascii=False)
+
+def _log_retry(retry_state) -> None:
+    """Report a retried Groq request on stderr so batch runs stay debuggable."""
+    print(
+        f"Groq request failed ({retry_state.outcome.exception()}); "
+        f"retrying in {retry_state.next_action.sleep:.1f}s "
+        f"(attempt {retry_state.attempt_number} of {MAX_ATTEMPTS})",
+        file=sys.stderr
+    )
+
+# Retry rate limits, connection failures and server errors with exponential
+# backoff; other client errors are raised immediately
+_retry_transient = retry(
+    wait=wait_exponential(multiplier=1, max=16),
+    stop=stop_after_attempt(MAX_ATTEMPTS),
+    retry=retry_if_exception_type((RateLimitError, APIConnectionError, InternalServerError)),
+    before_sleep=_log_retry,
+    reraise=True
+)
+
+@lru_cache(maxsize=None)
+def _get_encoding():
+    """Load the tiktoken encoding on first use, or None if it is unavailable."""
+    if tiktoken is None:
+        return None
+    try:
+        # The first call downloads the encoding, which can fail offline
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+class EmpathethicCodeReviewer:
+    """
+    AI-powered code review comment transformer that converts harsh feedback
+    into empathetic, educational guidance.
+    """
+    
+    # Groq clients shared across instances, keyed by API key, so warm
+    # connections and TLS sessions are reused
+    _clients: ClassVar[Dict[Optional[str], Groq]] = {}
+    
+    def __init__(self, api_key: str = None, model: str = DEFAULT_MODEL,
+                 cache_path: Optional[str] = CACHE_PATH, semantic_cache: bool = False,
+                 trim_code: bool = False):
+        """
+        Initialize the reviewer with Groq API key and response caches.
+        
+        Args:
+            api_key: Groq API key (defaults to the GROQ_API_KEY environment variable)
+            model: Groq model used for reviews; pass a larger model such as
+                "openai/gpt-oss-20b" when deeper reasoning is needed
+            cache_path: Location of the SQLite response cache, or None to
+                disable caching
+            semantic_cache: Also reuse reviews of near-duplicate requests
+            trim_code: Send only the parts of long snippets that the comments
+                refer to, plus surrounding context
+        """
+        self.model = model
+        self.trim_code = trim_code
+        self.client = self._get_client(api_key or os.getenv("GROQ_API_KEY"))
+        self.aclient = AsyncGroq(
+            api_key=api_key or os.getenv("GROQ_API_KEY"),
+            max_retries=0,
+        )
+        self._inflight: Dict[str, asyncio.Future] = {}
+        
+        # The connection is shared by worker threads; serialize access to it
+        self._cache_lock = threading.Lock()
+        self.cache = None
+        self.index = None
+        if cache_path is None:
+            if semantic_cache:
+                raise ValueError("semantic_cache requires a cache_path")
+            return
+        
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self.cache = sqlite3.connect(cache_path, check_same_thread=False)
+        self.cache.execute("PRAGMA journal_mode=WAL")
+        self.cache.execute(
+            "CREATE TABLE IF NOT EXISTS cache(key TEXT PRIMARY KEY, response TEXT)"
+        )
+        self.cache.commit()
+        
+        if semantic_cache:
+            self._init_semantic_cache(os.path.splitext(cache_path)[0])
     
-    def review_code(self, code_snippet: str, review_comments: List[str]) -> str:
+    @classmethod
+    def _get_client(cls, api_key: Optional[str]) -> Groq:
+        """Return the shared Groq client for an API key, creating it on first use."""
+        client = cls._clients.get(api_key)
+        if client is None:
+            http_client = httpx.Client(
+                http2=importlib.util.find_spec("h2") is not None,
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_CONNECTIONS
+                )
+            )
+            # Retries are handled by _retry_transient, not the SDK
+            client = Groq(api_key=api_key, http_client=http_client, max_retries=0)
+            cls._clients[api_key] = client
+        return client
+    
+    def _init_semantic_cache(self, base_path: str) -> None:
+        """
+        Load the embedding model and the HNSW index of previously seen reviews.
+        
+        Each model and system prompt gets its own index file and rows, so a
+        near-duplicate lookup never returns a review written under other settings.
+        """
+        import hnswlib
+        from sentence_transformers import SentenceTransformer
+        
+        self.embedder = SentenceTransformer(EMBEDDING_MODEL)
+        self.semantic_namespace = hashlib.sha256(
+            "\n".join((self.model, SYSTEM_PROMPT)).encode()
+        ).hexdigest()[:16]
+        self.cache.execute(
+            "CREATE TABLE IF NOT EXISTS semantic_cache("
+            "namespace TEXT, label INTEGER, response TEXT, PRIMARY KEY(namespace, label))"
+        )
+        self.cache.commit()
+        self.semantic_responses = [
+            row[0] for row in self.cache.execute(
+                "SELECT response FROM semantic_cache WHERE namespace=? ORDER BY label",
+                (self.semantic_namespace,)
+            )
+        ]
+        
+        self.index_path = f"{base_path}-{self.semantic_namespace}.hnsw"
+        self.index = hnswlib.Index(space='cosine', dim=EMBEDDING_DIM)
+        if os.path.exists(self.index_path):
+            self.index.load_index(self.index_path)
+            if self.index.get_current_count() == len(self.semantic_responses):
+                return
+        
+        # Missing or out of sync with the stored responses: start over
+        self.index = hnswlib.Index(space='cosine', dim=EMBEDDING_DIM)
+        self.index.init_index(max_elements=1024)
+        self.semantic_responses = []
+        with self.cache:
+            self.cache.execute(
+                "DELETE FROM semantic_cache WHERE namespace=?", (self.semantic_namespace,)
+            )
+    
+    def _embed(self, code_snippet: str, review_comments: List[str]):
+        """Embed a review request for near-duplicate lookup."""
+        return self.embedder.encode(code_snippet + "\n" + "\n".join(review_comments))
+    
+    def _semantic_get(self, vector) -> Optional[str]:
+        """Return the cached response of the nearest neighbor if it is close enough."""
+        # The index is not safe to query while another thread adds to it
+        with self._cache_lock:
+            if self.index.get_current_count() == 0:
+                return None
+            labels, distances = self.index.knn_query(vector, k=1)
+            label = labels[0][0]
+            if distances[0][0] < SEMANTIC_MAX_DISTANCE and label < len(self.semantic_responses):
+                return self.semantic_responses[label]
+        return None
+    
+    def _semantic_put(self, vector, response: str) -> None:
+        """Add a response to the semantic index and persist it to disk."""
+        # Hold the lock throughout so concurrent writers never share a label
+        with self._cache_lock:
+            label = len(self.semantic_responses)
+            if label >= self.index.get_max_elements():
+                self.index.resize_index(2 * self.index.get_max_elements())
+            self.index.add_items(vector, label)
+            self.semantic_responses.append(response)
+            with self.cache:
+                self.cache.execute(
+                    "INSERT OR REPLACE INTO semantic_cache(namespace, label, response) "
+                    "VALUES (?, ?, ?)",
+                    (self.semantic_namespace, label, response)
+                )
+            self.index.save_index(self.index_path)
+    
+    def _cache_key(self, prompt: str, system_prompt: str = SYSTEM_PROMPT) -> str:
+        """Compute the exact-match cache key for a prompt."""
+        return hashlib.sha256(
+            "\n".join((self.model, system_prompt, prompt)).encode()
+        ).hexdigest()
+    
+    def _cache_get(self, key: str) -> Optional[str]:
+        """Return the cached response for a key, or None on a miss."""
+        if self.cache is None:
+            return None
+        with self._cache_lock:
+            row = self.cache.execute(
+                "SELECT response FROM cache WHERE key=?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+    
+    def _cache_put(self, key: str, response: str) -> None:
+        """Store a response in the cache."""
+        if self.cache is None:
+            return
+        with self._cache_lock, self.cache:
+            self.cache.execute(
+                "INSERT OR REPLACE INTO cache(key, response) VALUES (?, ?)",
+                (key, response)
+            )
+    
+    def _analyze_comment_severity(self, comment: str) -> str:
+        """Analyze the severity/tone of a review comment."""
+        if HARSH_RE.search(comment):
+            return "harsh"
+        elif NEUTRAL_RE.search(comment):
+            return "neutral"
+        else:
+            return "constructive"
+    
+    def _detect_severities(self, comments: List[str]) -> List[str]:
+        """Return the distinct severity levels present in comments, in a stable order."""
+        found = set()
+        for comment in comments:
+            found.add(self._analyze_comment_severity(comment))
+            if len(found) == len(SEVERITY_LEVELS):
+                break
+        return [level for level in SEVERITY_LEVELS if level in found]
+    
+    def _get_language_from_code(self, code_snippet: str) -> str:
+        """Detect programming language from code snippet."""
+        match = LANG_RE.search(code_snippet)
+        if match:
+            return LANG_NAMES[match.lastgroup]
+        
+        if guess_lexer is not None:
+            try:
+                lexer = guess_lexer(code_snippet)
+            except ClassNotFound:
+                lexer = None
+            if (lexer is not None and lexer.name in LEXER_LANGUAGES
+                    and lexer.analyse_text(code_snippet) >= MIN_LEXER_CONFIDENCE):
+                return lexer.name
+        
+        return DEFAULT_LANGUAGE
+    
+    def _count_tokens(self, text: str) -> int:
+        """Count (or, without tiktoken, estimate) the tokens in a text."""
+        encoding = _get_encoding()
+        if encoding is not None:
+            return len(encoding.encode(text))
+        return len(text) // 4
+    
+    def _trim_code_snippet(self, code_snippet: str, comments: List[str], language: str) -> str:
+        """
+        Keep only the lines of a long snippet that the comments refer to.
+        
+        Lines mentioning a quoted fragment or an identifier from the comments
+        are kept with TRIM_CONTEXT_LINES of context on each side; the rest is
+        replaced by elision markers. Short snippets, and snippets where no
+        referenced line can be found, are returned unchanged.
+        """
+        if self._count_tokens(code_snippet) <= MAX_CODE_TOKENS:
+            return code_snippet
+        
+        text = "\n".join(comments)
+        quoted = {next(group for group in match.groups() if group)
+                  for match in QUOTED_RE.finditer(text)}
+        code_identifiers = set(IDENTIFIER_RE.findall(code_snippet))
+        identifiers = {word for word in IDENTIFIER_RE.findall(text)
+                       if word in code_identifiers and len(word) > 2
+                       and not keyword.iskeyword(word)}
+        identifiers.update(fragment for fragment in quoted if IDENTIFIER_RE.fullmatch(fragment))
+        fragments = {fragment for fragment in quoted if not IDENTIFIER_RE.fullmatch(fragment)}
+        identifier_re = (re.compile(r"\b(?:" + "|".join(map(re.escape, identifiers)) + r")\b")
+                         if identifiers else None)
+        
+        lines = code_snippet.splitlines()
+        keep = [False] * len(lines)
+        for i, line in enumerate(lines):
+            if (any(fragment in line for fragment in fragments)
+                    or (identifier_re is not None and identifier_re.search(line))):
+                for j in range(max(0, i - TRIM_CONTEXT_LINES),
+                               min(len(lines), i + TRIM_CONTEXT_LINES + 1)):
+                    keep[j] = True
+        
+        if all(keep) or not any(keep):
+            return code_snippet
+        
+        marker = ("# " if language in HASH_COMMENT_LANGUAGES else "// ") + "…elided…"
+        trimmed = []
+        for line, kept in zip(lines, keep):
+            if kept:
+                trimmed.append(line)
+            elif not trimmed or trimmed[-1] != marker:
+                trimmed.append(marker)
+        return "\n".join(trimmed)
+    
+    def _create_empathetic_prompt(self, code_snippet: str, comments: List[str]) -> str:
+        """Create the per-request prompt; the static instructions live in SYSTEM_PROMPT."""
+        
+        language = self._get_language_from_code(code_snippet)
+        severities = self._detect_severities(comments)
+        if self.trim_code:
+            code_snippet = self._trim_code_snippet(code_snippet, comments, language)
+        
+        return PROMPT_TEMPLATE.substitute(
+            language=language,
+            code_fence=language.lower(),
+            count=len(comments),
+            severities=", ".join(severities),
+            code=code_snippet,
+            comments="\n".join(f"{i}. {comment}" for i, comment in enumerate(comments, 1))
+        )
+    
+    def _create_batch_prompt(self, code_snippets: List[str], comments_list: List[List[str]]) -> str:
+        """Pack several review requests into one prompt asking for a JSON-keyed response."""
+        
+        cases = "\n\n".join(
+            f'<case id="{i}">\n{self._create_empathetic_prompt(code_snippet, comments)}\n</case>'
+            for i, (code_snippet, comments) in enumerate(zip(code_snippets, comments_list), 1)
+        )
+        
+        return f"""You will review {len(code_snippets)} independent cases. Each case is wrapped in <case id="N"> tags.
+
+{cases}
+
+**Response Format:**
+Respond with a single JSON object whose keys are the case ids ("1", "2", ...) and whose values are the complete Markdown review for that case, written in the format above."""
+    
+    def warm_up(self) -> None:
+        """
+        List the available models so the connection pool is open before the first review.
+        
+        The listing is not billed, unlike a completion. Failures are ignored;
+        the real request reports any problem.
+        """
+        try:
+            self.client.models.list()
+        except Exception:
+            pass
+    
+    def needs_request(self, code_snippet: str, review_comments: List[str],
+                      structured: bool = False) -> bool:
+        """
+        Whether reviewing these comments will call the model.
+        
+        False when every comment is rendered locally or the review is in the
+        exact-match cache. A semantic-cache hit is only known after embedding
+        the request, so it still counts as a request.
+        """
+        llm_comments = [comment for comment in review_comments if not self._is_fast_path(comment)]
+        if not llm_comments:
+            return False
+        
+        prompt = self._create_empathetic_prompt(code_snippet, llm_comments)
+        system_prompt = STRUCTURED_SYSTEM_PROMPT if structured else SYSTEM_PROMPT
+        return self._cache_get(self._cache_key(prompt, system_prompt)) is None
+    
+    @_retry_transient
+    def _create_completion(self, **kwargs):
+        """Create a chat completion, retrying transient failures."""
+        return self.client.chat.completions.create(**kwargs)
+    
+    @_retry_transient
+    async def _acreate_completion(self, **kwargs):
+        """Create a chat completion with the async client, retrying transient failures."""
+        return await self.aclient.chat.completions.create(**kwargs)
+    
+    def _max_tokens(self, comments: List[str]) -> int:
+        """Output token budget for reviewing a list of comments."""
+        return MAX_TOKENS_PER_COMMENT * max(1, len(comments))
+    
+    def _build_messages(self, prompt: str,
+                        system_prompt: str = SYSTEM_PROMPT) -> List[Dict[str, str]]:
+        """Build the chat messages sent to the model for a prompt."""
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _lookup_cache(self, code_snippet: str, review_comments: List[str], prompt: str):
+        """
+        Look up a review in the exact-match and semantic caches.
+        
+        Returns:
+            Tuple of (cache key, embedding vector or None, cached review or None)
+        """
+        key = self._cache_key(prompt)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return key, None, cached
+        
+        vector = None
+        if self.index is not None:
+            vector = self._embed(code_snippet, review_comments)
+            cached = self._semantic_get(vector)
+        return key, vector, cached
+    
+    def _store_cache(self, key: str, vector, result: str) -> None:
+        """Store a freshly generated review in the caches."""
+        self._cache_put(key, result)
+        if vector is not None:
+            self._semantic_put(vector, result)
+    
+    def _is_fast_path(self, comment: str) -> bool:
+        """
+        Whether a comment is short and constructive enough to render without the model.
+        
+        A comment qualifies only if it is phrased as a suggestion or praise;
+        comments without such a signal may still be blunt and go to the model.
+        """
+        return (len(comment) < FAST_PATH_MAX_LENGTH
+                and FAST_PATH_RE.search(comment) is not None
+                and not HARSH_RE.search(comment)
+                and not FAST_PATH_EXCLUDE_RE.search(comment))
+    
+    def _local_comment_review(self, comment: str) -> CommentReview:
+        """Build the canned review of a fast-path comment."""
+        return CommentReview(
+            original=comment,
+            positive=f"{LOCAL_POSITIVE_PREFIX} {comment}",
+            why=LOCAL_WHY,
+            fix="",
+            link=""
+        )
+    
+    def _strip_rules(self, section: str) -> str:
+        """Strip surrounding blank lines and horizontal rules from a Markdown section."""
+        lines = section.strip().split("\n")
+        while lines and lines[0].strip() in ("", "---"):
+            lines.pop(0)
+        while lines and lines[-1].strip() in ("", "---"):
+            lines.pop()
+        return "\n".join(lines)
+    
+    def _render_local_review(self, comments: List[str]) -> str:
+        """Render a complete review when every comment takes the fast path."""
+        return render_markdown(StructuredReview(
+            comments=[self._local_comment_review(comment) for comment in comments],
+            overall=LOCAL_OVERALL_ASSESSMENT
+        ))
+    
+    def _merge_reviews(self, comments: List[str], llm_review: str) -> str:
+        """
+        Merge locally rendered sections into a model review in original comment order.
+        
+        If the model review does not contain one section per comment it was
+        given, the local sections are placed after the model's sections.
+        """
+        head, heading, overall = llm_review.partition(OVERALL_HEADING)
+        preamble, *sections = SECTION_RE.split(head)
+        llm_sections = [self._strip_rules(section) for section in sections]
+        local_sections = {
+            i: self._strip_rules(render_comment_markdown(self._local_comment_review(comment)))
+            for i, comment in enumerate(comments) if self._is_fast_path(comment)
+        }
+        
+        if len(llm_sections) != len(comments) - len(local_sections):
+            ordered = llm_sections + list(local_sections.values())
+        else:
+            remaining = iter(llm_sections)
+            ordered = [local_sections[i] if i in local_sections else next(remaining)
+                       for i in range(len(comments))]
+        
+        preamble = self._strip_rules(preamble)
+        merged = (f"{preamble}\n\n" if preamble else "") + "---\n" + "\n\n---\n\n".join(ordered)
+        return merged + "\n\n---\n\n" + heading + overall
+    
+    def review_code(self, code_snippet: str, review_comments: List[str],
+                    stream_to: Optional[TextIO] = None) -> str:
         """
         Transform review comments into empathetic feedback.
         
+        Short comments phrased as suggestions or praise are rendered locally;
+        only the remaining comments are sent to the model.
+        
         Args:
             code_snippet: The code being reviewed
             review_comments: List of original review comments
+            stream_to: Optional text stream (e.g. sys.stdout) that receives the
+                review incrementally as tokens arrive; when some comments are
+                rendered locally, the merged review is written once complete
             
         Returns:
             Markdown-formatted empathetic review
         """
+        llm_comments = [comment for comment in review_comments if not self._is_fast_path(comment)]
+        if len(llm_comments) == len(review_comments):
+            return self._review_llm(code_snippet, review_comments, stream_to)
+        
+        if not llm_comments:
+            result = self._render_local_review(review_comments)
+            if stream_to is not None:
+                stream_to.write(result)
+                stream_to.flush()
+            return result
+        
+        # Mixed comments: the model output must be merged before it is shown
+        result = self._review_llm(code_snippet, llm_comments)
+        if not result.startswith(ERROR_PREFIX):
+            result = self._merge_reviews(review_comments, result)
+        if stream_to is not None:
+            stream_to.write(result)
+            stream_to.flush()
+        return result
+    
+    def _review_llm(self, code_snippet: str, review_comments: List[str],
+                    stream_to: Optional[TextIO] = None) -> str:
+        """Serve a review from the caches or generate it with the model."""
         try:
             prompt = self._create_empathetic_prompt(code_snippet, review_comments)
             
-            response = self.client.chat.completions.create(
-                model="openai/gpt-oss-20b",
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": "You are an senior software engineer and mentor specializing in empathetic, educational code reviews. You excel at transforming harsh feedback into constructive guidance while maintaining technical accuracy."
-                    },
-                    {"role": "user", "content": prompt}
-                ],
+            key, vector, cached = self._lookup_cache(code_snippet, review_comments, prompt)
+            if cached is not None:
+                if stream_to is not None:
+                    stream_to.write(cached)
+                    stream_to.flush()
+                return cached
+            
+            response = self._create_completion(
+                model=self.model,
+                messages=self._build_messages(prompt),
+                max_tokens=self._max_tokens(review_comments),
+                stop=STOP_SEQUENCES,
+                stream=stream_to is not None,
+            )
+            
+            if stream_to is None:
+                result = response.choices[0].message.content
+            else:
+                buf = []
+                for chunk in response:
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        stream_to.write(delta)
+                        stream_to.flush()
+                        buf.append(delta)
+                result = "".join(buf)
+            
+            self._store_cache(key, vector, result)
+            return result
+            
+        except Exception as e:
+            error = f"{ERROR_PREFIX}{str(e)}"
+            if stream_to is not None:
+                stream_to.write(error)
+                stream_to.flush()
+            return error
+    
+    async def review_code_async(self, code_snippet: str, review_comments: List[str]) -> str:
+        """
+        Asynchronous variant of review_code for running many reviews concurrently.
+        
+        Concurrent calls for the same prompt share a single in-flight request,
+        and short suggestion-style comments are rendered locally as in review_code.
+        
+        Args:
+            code_snippet: The code being reviewed
+            review_comments: List of original review comments
+            
+        Returns:
+            Markdown-formatted empathetic review
+        """
+        llm_comments = [comment for comment in review_comments if not self._is_fast_path(comment)]
+        if len(llm_comments) == len(review_comments):
+            return await self._review_llm_async(code_snippet, review_comments)
+        
+        if not llm_comments:
+            return self._render_local_review(review_comments)
+        
+        result = await self._review_llm_async(code_snippet, llm_comments)
+        if result.startswith(ERROR_PREFIX):
+            return result
+        return self._merge_reviews(review_comments, result)
+    
+    async def _review_llm_async(self, code_snippet: str, review_comments: List[str]) -> str:
+        """Generate a model review, sharing one in-flight request per prompt."""
+        prompt = self._create_empathetic_prompt(code_snippet, review_comments)
+        key = self._cache_key(prompt)
+        
+        # No await between the check and the insert, so this is atomic on the event loop
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._generate_review_async(code_snippet, review_comments, prompt)
+            future.set_result(result)
+            return result
+        finally:
+            if not future.done():
+                future.cancel()
+            del self._inflight[key]
+    
+    async def _generate_review_async(self, code_snippet: str, review_comments: List[str],
+                                     prompt: str) -> str:
+        """Serve a review from the caches or generate it with the async client."""
+        try:
+            key, vector, cached = self._lookup_cache(code_snippet, review_comments, prompt)
+            if cached is not None:
+                return cached
+            
+            response = await self._acreate_completion(
+                model=self.model,
+                messages=self._build_messages(prompt),
+                max_tokens=self._max_tokens(review_comments),
+                stop=STOP_SEQUENCES,
+                stream=False,
+            )
+            
+            result = response.choices[0].message.content
+            self._store_cache(key, vector, result)
+            return result
+            
+        except Exception as e:
+            return f"{ERROR_PREFIX}{str(e)}"
+    
+    def review_code_batch(self, code_snippets: List[str],
+                          comments_list: List[List[str]]) -> List[str]:
+        """
+        Transform several independent reviews with a single API request.
+        
+        Cached cases are served locally; the remaining cases are packed into
+        one prompt and the model returns a JSON object keyed by case id.
+        
+        Args:
+            code_snippets: The code being reviewed, one entry per case
+            comments_list: The original review comments for each case
+            
+        Returns:
+            Markdown-formatted empathetic reviews, in the same order as the input
+        """
+        if len(code_snippets) != len(comments_list):
+            raise ValueError("code_snippets and comments_list must have the same length")
+        
+        results: List[Optional[str]] = []
+        misses = []
+        for code_snippet, comments in zip(code_snippets, comments_list):
+            prompt = self._create_empathetic_prompt(code_snippet, comments)
+            key, vector, cached = self._lookup_cache(code_snippet, comments, prompt)
+            if cached is None:
+                misses.append((len(results), key, vector))
+            results.append(cached)
+        
+        if not misses:
+            return results
+        
+        try:
+            prompt = self._create_batch_prompt(
+                [code_snippets[i] for i, _, _ in misses],
+                [comments_list[i] for i, _, _ in misses]
+            )
+            
+            response = self._create_completion(
+                model=self.model,
+                messages=self._build_messages(prompt),
+                max_tokens=sum(self._max_tokens(comments_list[i]) for i, _, _ in misses),
+                response_format={"type": "json_object"},
                 stream=False,
             )
             
-            return response.choices[0].message.content
+            reviews = _json_loads(response.choices[0].message.content)
+            for case_id, (i, key, vector) in enumerate(misses, 1):
+                review = reviews.get(str(case_id))
+                if isinstance(review, str):
+                    review = review.rstrip().removesuffix(END_MARKER).rstrip()
+                    self._store_cache(key, vector, review)
+                    results[i] = review
+                else:
+                    results[i] = f"{ERROR_PREFIX}missing case {case_id} in batch response"
             
         except Exception as e:
-            return f"Error generating empathetic review: {str(e)}"
+            for i, _, _ in misses:
+                results[i] = f"{ERROR_PREFIX}{str(e)}"
+        
+        return results
     
-    def process_json_input(self, json_data: Dict[str, Any]) -> str:
-        """Process JSON input and return empathetic review."""
+    def _parse_structured_review(self, content: str, expected_count: int) -> StructuredReview:
+        """Validate a JSON-mode response and normalize it into a StructuredReview."""
+        try:
+            data = _json_loads(content)
+        except ValueError as e:
+            raise ValueError(f"Model returned invalid JSON: {str(e)}") from None
+        if not isinstance(data, dict) or not isinstance(data.get('comments'), list):
+            raise ValueError("Model response does not match the structured review schema")
+        
+        comments = [
+            CommentReview(**{field: str(entry.get(field) or "") for field in CommentReview.__annotations__})
+            for entry in data['comments'] if isinstance(entry, dict)
+        ]
+        if len(comments) != expected_count:
+            raise ValueError(
+                f"Model returned {len(comments)} comment reviews, expected {expected_count}"
+            )
+        
+        return StructuredReview(comments=comments, overall=str(data.get('overall') or ""))
+    
+    def review_code_structured(self, code_snippet: str,
+                               review_comments: List[str]) -> StructuredReview:
+        """
+        Transform review comments into a structured review.
+        
+        The model answers in JSON mode, so programmatic consumers get one entry
+        per comment without parsing Markdown; render_markdown turns the result
+        into the usual report. Short suggestion-style comments are reviewed locally
+        as in review_code.
+        
+        Args:
+            code_snippet: The code being reviewed
+            review_comments: List of original review comments
+            
+        Returns:
+            Structured review with one entry per comment, in the original order
+            
+        Raises:
+            ValueError: If the model response is not a valid structured review
+        """
+        llm_comments = [comment for comment in review_comments if not self._is_fast_path(comment)]
+        if not llm_comments:
+            return StructuredReview(
+                comments=[self._local_comment_review(comment) for comment in review_comments],
+                overall=LOCAL_OVERALL_ASSESSMENT
+            )
+        
+        prompt = self._create_empathetic_prompt(code_snippet, llm_comments)
+        key = self._cache_key(prompt, STRUCTURED_SYSTEM_PROMPT)
+        content = self._cache_get(key)
+        if content is not None:
+            review = self._parse_structured_review(content, len(llm_comments))
+        else:
+            response = self._create_completion(
+                model=self.model,
+                messages=self._build_messages(prompt, STRUCTURED_SYSTEM_PROMPT),
+                max_tokens=self._max_tokens(llm_comments),
+                response_format={"type": "json_object"},
+                stream=False,
+            )
+            content = response.choices[0].message.content
+            review = self._parse_structured_review(content, len(llm_comments))
+            self._cache_put(key, content)
+        
+        llm_reviews = iter(review['comments'])
+        comments = []
+        for comment in review_comments:
+            if self._is_fast_path(comment):
+                comments.append(self._local_comment_review(comment))
+                continue
+            entry = next(llm_reviews)
+            entry['original'] = comment
+            comments.append(entry)
+        
+        return StructuredReview(comments=comments, overall=review['overall'])
+    
+    def process_json_input(self, json_data: Dict[str, Any],
+                           stream_to: Optional[TextIO] = None,
+                           structured: bool = False) -> Union[str, StructuredReview]:
+        """Process JSON input and return empathetic review (structured if requested)."""
         if 'code_snippet' not in json_data or 'review_comments' not in json_data:
             raise ValueError("JSON must contain 'code_snippet' and 'review_comments' keys")
         
+        if structured:
+            return self.review_code_structured(
+                json_data['code_snippet'],
+                json_data['review_comments']
+            )
+        
         return self.review_code(
             json_data['code_snippet'], 
-            json_data['review_comments']
+            json_data['review_comments'],
+            stream_to=stream_to
         )
 
 def main():
@@ -170,25 +1043,66 @@ def main():
         '-o', '--output', 
         help='Output file for the empathetic review (default: stdout)'
     )
+    parser.add_argument(
+        '-m', '--model',
+        default=DEFAULT_MODEL,
+        help=f'Groq model to use (default: {DEFAULT_MODEL})'
+    )
+    parser.add_argument(
+        '--trim',
+        action='store_true',
+        help='Send only the parts of long code snippets referenced by the comments'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Always request a fresh review instead of reusing cached ones'
+    )
+    parser.add_argument(
+        '-f', '--format',
+        choices=['markdown', 'json'],
+        default='markdown',
+        help='Output format (default: markdown)'
+    )
     
     args = parser.parse_args()
     
     try:
+        # Create reviewer
+        reviewer = EmpathethicCodeReviewer(
+            model=args.model,
+            cache_path=None if args.no_cache else CACHE_PATH,
+            trim_code=args.trim
+        )
+        
         # Load input JSON
-        with open(args.input_file, 'r') as f:
-            input_data = json.load(f)
+        with open(args.input_file, 'rb') as f:
+            input_data = _json_loads(f.read())
         
-        # Create reviewer and process
-        reviewer = EmpathethicCodeReviewer()
-        result = reviewer.process_json_input(input_data)
+        # Open the connection while the review is prepared, unless it will be
+        # served from the cache or rendered locally
+        if reviewer.needs_request(input_data.get('code_snippet', ''),
+                                  input_data.get('review_comments', []),
+                                  structured=args.format == 'json'):
+            threading.Thread(target=reviewer.warm_up, daemon=True).start()
         
-        # Output result
-        if args.output:
+        # Output result, streaming Markdown to stdout as it is generated
+        if args.format == 'json':
+            result = _json_dumps(reviewer.process_json_input(input_data, structured=True))
+            if args.output:
+                with open(args.output, 'w') as f:
+                    f.write(result)
+                print(f"Empathetic review written to {args.output}")
+            else:
+                print(result)
+        elif args.output:
+            result = reviewer.process_json_input(input_data)
             with open(args.output, 'w') as f:
                 f.write(result)
             print(f"Empathetic review written to {args.output}")
         else:
-            print(result)
+            reviewer.process_json_input(input_data, stream_to=sys.stdout)
+            print()
             
     except FileNotFoundError:
         print(f"Error: Input file '{args.input_file}' not found", file=sys.stderr)